@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+'''
+Compare request body size and build time for ``have`` exclusion lists as the
+number of known bookmark IDs grows from 1k to 1M.
+
+Columns: size of the urlencoded POST body with every ID; time to join a
+plain list on every call versus fetching an IDSet's cached joined form; time
+to urlencode the full body; and body size and total build time when the
+IDSet is cut to the newest 5000 IDs.  "stored" is the delta-encoded size from
+IDSet.to_bytes().  Urlencoding the full list dominates at scale, so the
+window is what keeps requests bounded.
+'''
+
+import os
+import random
+import sys
+import timeit
+
+from future.moves.urllib.parse import urlencode
+
+try:
+    import pyinstapaper  # noqa
+except ImportError:
+    sys.path.insert(
+        0, (os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from pyinstapaper.idset import IDSet
+
+COUNTS = [1000, 10000, 100000, 1000000]
+WINDOW = 5000
+# bookmark IDs are currently around this magnitude
+FIRST_ID = 1000000000
+
+
+def body(have):
+    return urlencode({'folder_id': 'archive', 'limit': 500, 'have': have})
+
+
+def best_of(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def main():
+    print('%8s | %10s | %10s %10s | %10s | %9s %9s | %9s' % (
+        'IDs', 'body KB', 'list join', 'IDSet join', 'encode ms',
+        'window KB', 'window ms', 'stored KB'))
+    for count in COUNTS:
+        ids = random.sample(range(FIRST_ID, FIRST_ID + count * 20), count)
+        number = max(1, 100000 // count)
+        idset = IDSet(ids)
+        joined = idset.joined()
+        idset.joined(WINDOW)
+
+        list_ms = best_of(
+            lambda: ','.join(str(id_) for id_ in ids), number) * 1e3
+        set_ms = best_of(idset.joined, number) * 1e3
+        encode_ms = best_of(lambda: body(joined), number) * 1e3
+        window_ms = best_of(lambda: body(idset.joined(WINDOW)), number) * 1e3
+        print('%8d | %10.1f | %10.2f %10.4f | %10.2f | %9.1f %9.2f | %9.1f' % (
+            count, len(body(joined)) / 1024.0, list_ms, set_ms, encode_ms,
+            len(body(idset.joined(WINDOW))) / 1024.0, window_ms,
+            len(idset.to_bytes()) / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+'''asyncio support for ``pyinstapaper.watch``, kept apart as python3 only.'''
+import asyncio
+
+from pyinstapaper.watch import _STOP
+
+
+class _LoopQueue(object):
+
+    '''Hands events from the polling thread to an ``asyncio.Queue``.'''
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def put(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:
+            # the consumer's loop has been closed
+            pass
+
+
+async def aiter_events(watcher, types=None):
+    '''Yield watcher events until it stops or the consumer goes away.'''
+    sink = _LoopQueue(asyncio.get_event_loop())
+    watcher._add_queue(sink, types)
+    try:
+        while True:
+            event = await sink.queue.get()
+            if event is _STOP:
+                return
+            yield event
+    finally:
+        watcher._remove_queue(sink)
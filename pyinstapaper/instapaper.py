@@ -1,14 +1,24 @@
 # -*- coding: utf-8 -*-
+from collections import namedtuple
 from datetime import datetime
 
 import json
 import logging
+import threading
 import time
 
 import oauth2 as oauth
 
 # for python2/3 compat
 from future.moves.urllib.parse import urlencode, parse_qsl
+from future.utils import string_types
+
+from pyinstapaper.idset import IDSet
+
+from pyinstapaper.profiling import stage, timed
+from pyinstapaper.serialization import get_codec
+from pyinstapaper.transport import Transport
+from pyinstapaper.watch import Watcher
 
 BASE_URL = 'https://www.instapaper.com'
 API_VERSION = '1'
@@ -16,20 +26,175 @@ ACCESS_TOKEN = 'oauth/access_token'
 LOGIN_URL = 'https://www.instapaper.com/user/login'
 REQUEST_DELAY_SECS = 0.5
 
+ERROR_EMPTY_HIGHLIGHT = 1600
+ERROR_DUPLICATE_HIGHLIGHT = 1601
+
 log = logging.getLogger(__name__)
 
 
+def _to_timestamp(val):
+    '''Return the Unix timestamp for a naive local datetime.'''
+    try:
+        # respects fold, so times repeated at DST changes round-trip
+        return int(val.timestamp())
+    except AttributeError:
+        # python2
+        return int(time.mktime(val.timetuple()))
+
+
+def _parse_ids(ids):
+    '''Return a list of int IDs from a list or comma-separated string.'''
+    if not isinstance(ids, list):
+        ids = str(ids).split(',')
+    parsed = []
+    for id_ in ids:
+        try:
+            parsed.append(int(id_))
+        except (TypeError, ValueError):
+            if str(id_).strip():
+                log.warn('Ignoring unexpected bookmark ID %r', id_)
+    return parsed
+
+
+class InstapaperError(Exception):
+    '''An error object returned by the Instapaper API.
+
+    :param int error_code: Instapaper error code, e.g. 1241
+    :param str message: Error message from the API
+    '''
+
+    def __init__(self, error_code, message):
+        super(InstapaperError, self).__init__(
+            'Instapaper error %d: %s' % (error_code, message))
+        self.error_code = error_code
+        self.message = message
+
+
+# monotonic where available, so clock changes don't stall the rate limiter
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class RateLimiter(object):
+    '''Space requests at least ``interval`` seconds apart across threads.
+
+    Each caller reserves the next free slot under a lock and then sleeps
+    outside it, so waiting threads don't block each other's bookkeeping.
+
+    :param float interval: Minimum seconds between requests, defaults to
+        ``REQUEST_DELAY_SECS`` as set at the time of each call
+    '''
+
+    def __init__(self, interval=None):
+        self.interval = interval
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        interval = REQUEST_DELAY_SECS if self.interval is None \
+            else self.interval
+        with self._lock:
+            now = _clock()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class _ClientPool(object):
+    '''Hands each in-flight request its own ``oauth.Client``.
+
+    ``oauth.Client`` (an ``httplib2.Http``) keeps connection state and is not
+    safe to share between threads, so idle clients are kept in a pool and new
+    ones are created when every pooled client is busy.
+    '''
+
+    def __init__(self, consumer, token, client):
+        self.consumer = consumer
+        self.token = token
+        self._idle = [client]
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return oauth.Client(self.consumer, self.token)
+
+    def release(self, client):
+        with self._lock:
+            self._idle.append(client)
+
+
+class OAuthTransport(Transport):
+    '''Default transport: signs and sends requests with ``oauth2``.
+
+    Each request borrows an ``oauth.Client`` from the ``Instapaper``
+    instance's pool, so it is safe to use from several threads.
+    '''
+
+    def request(self, instapaper, uri, method='POST', body=None):
+        pool = instapaper._session.pool
+        client = pool.acquire()
+        try:
+            kwargs = {'method': method}
+            if body:
+                kwargs['body'] = body
+            return client.request(uri, **kwargs)
+        finally:
+            pool.release(client)
+
+
+# an immutable snapshot of what requests are signed with; login() swaps the
+# whole session at once so a request never sees a half-updated client
+_Session = namedtuple('_Session', ['token', 'oauth_client', 'pool'])
+
+
 class Instapaper(object):
     '''Instapaper client class.
 
+    An instance may be shared between threads: every request borrows its own
+    OAuth client from a pool, credentials are replaced atomically on login,
+    and a shared :class:`RateLimiter` spaces out requests from all threads.
+
     :param oauth_key str: Instapaper OAuth consumer key
     :param oauth_secret str: Instapaper OAuth consumer secret
+    :param float request_delay: Optional minimum seconds between requests,
+        defaults to ``REQUEST_DELAY_SECS``
+    :param transport: Optional ``pyinstapaper.transport.Transport``, e.g. a
+        ``Recorder`` or ``Replayer``; defaults to :class:`OAuthTransport`
     '''
 
-    def __init__(self, oauth_key, oauth_secret):
+    def __init__(self, oauth_key, oauth_secret, request_delay=None,
+                 transport=None):
         self.consumer = oauth.Consumer(oauth_key, oauth_secret)
+        self.rate_limiter = RateLimiter(request_delay)
+        self.transport = transport or OAuthTransport()
         self.oauth_client = oauth.Client(self.consumer)
-        self.token = None
+
+    @property
+    def token(self):
+        '''The ``oauth.Token`` requests are signed with, None before login.'''
+        return self._session.token
+
+    @property
+    def oauth_client(self):
+        '''The OAuth client created for the current credentials.
+
+        Requests may also run on other pooled clients with the same
+        credentials.
+        '''
+        return self._session.oauth_client
+
+    @oauth_client.setter
+    def oauth_client(self, client):
+        token = getattr(client, 'token', None)
+        if not isinstance(token, oauth.Token):
+            token = None
+        self._start_session(token, client)
+
+    def _start_session(self, token, client):
+        self._session = _Session(
+            token, client, _ClientPool(self.consumer, token, client))
 
     def login(self, username, password):
         '''Authenticate using XAuth variant of OAuth.
@@ -47,13 +212,13 @@ class Instapaper(object):
             returns_json=False
         )
         token = dict(parse_qsl(response['data'].decode()))
-        self.token = oauth.Token(
-            token['oauth_token'], token['oauth_token_secret'])
-        self.oauth_client = oauth.Client(self.consumer, self.token)
+        token = oauth.Token(token['oauth_token'], token['oauth_token_secret'])
+        self._start_session(token, oauth.Client(self.consumer, token))
 
+    @timed('request')
     def request(self, path, params=None, returns_json=True,
                 method='POST', api_version=API_VERSION):
-        '''Process a request using the OAuth client's request method.
+        '''Process a request using the client's transport.
 
         :param str path: Path fragment to the API endpoint, e.g. "resource/ID"
         :param dict params: Parameters to pass to request
@@ -62,28 +227,25 @@ class Instapaper(object):
         :returns: response headers and body
         :retval: dict
         '''
-        time.sleep(REQUEST_DELAY_SECS)
+        with stage('sleep'):
+            self.rate_limiter.wait()
         full_path = '/'.join([BASE_URL, 'api/%s' % api_version, path])
         params = urlencode(params) if params else None
         log.debug('URL: %s', full_path)
-        request_kwargs = {'method': method}
-        if params:
-            request_kwargs['body'] = params
-        response, content = self.oauth_client.request(
-            full_path, **request_kwargs)
+        with stage('transport'):
+            response, content = self.transport.request(
+                self, full_path, method=method, body=params)
         log.debug('CONTENT: %s ...', content[:50])
         if returns_json:
             try:
-                data = json.loads(content)
+                with stage('json'):
+                    data = json.loads(content)
                 if isinstance(data, list) and len(data) == 1:
                     # ugly -- API always returns a list even when you expect
                     # only one item
                     if data[0]['type'] == 'error':
-                        raise Exception('Instapaper error %d: %s' % (
-                            data[0]['error_code'],
-                            data[0]['message'])
-                        )
-                    # TODO: PyInstapaperException custom class?
+                        raise InstapaperError(
+                            data[0]['error_code'], data[0]['message'])
             except ValueError:
                 # Instapaper API can be unpredictable/inconsistent, e.g.
                 # bookmarks/get_text doesn't return JSON
@@ -95,31 +257,104 @@ class Instapaper(object):
             'data': data
         }
 
-    def get_bookmarks(self, folder='unread', limit=25, have=None):
+    @timed('get_bookmarks')
+    def get_bookmarks(self, folder='unread', limit=25, have=None,
+                      have_window=None):
         """Return list of user's bookmarks.
 
         :param str folder: Optional. Possible values are unread (default),
             starred, archive, or a folder_id value.
         :param int limit: Optional. A number between 1 and 500, default 25.
-        :param list have: Optional. A list of IDs to exclude from results
+        :param list have: Optional. A list or ``IDSet`` of IDs to exclude
+            from results
+        :param int have_window: Optional. Send only the newest
+            ``have_window`` IDs of ``have``; see ``get_bookmark_changes``
         :returns: List of user's bookmarks
         :rtype: list
         """
+        return self._list_bookmarks(
+            folder, limit, have, have_window)['bookmarks']
+
+    @timed('get_bookmark_changes')
+    def get_bookmark_changes(self, folder='unread', limit=25, have=None,
+                             have_window=None):
+        """Return bookmarks along with IDs the server reports as deleted.
+
+        Entries in ``have`` may be plain IDs or ``"ID:hash"`` strings (see
+        ``Bookmark.have_token``), in which case the server only returns a
+        known bookmark if its hash has changed.  A pre-joined string is sent
+        as is.
+
+        For large libraries pass an ``IDSet``, whose joined form is cached
+        between calls, and a ``have_window``: only the newest IDs are sent
+        and any older known bookmarks the server returns are dropped from
+        the results, so fewer than ``limit`` bookmarks may come back.
+        Deletions are only reported for IDs inside the window.
+
+        :param str folder: Optional. Possible values are unread (default),
+            starred, archive, or a folder_id value.
+        :param int limit: Optional. A number between 1 and 500, default 25.
+        :param list have: Optional. A list of IDs to exclude from results
+        :param int have_window: Optional. Send only the newest
+            ``have_window`` IDs; needs plain IDs rather than ``ID:hash``
+        :returns: dict with bookmarks, highlights and delete_ids lists
+        :rtype: dict
+        """
+        return self._list_bookmarks(
+            folder, limit, have, have_window, changes=True)
+
+    def _list_bookmarks(self, folder, limit, have, have_window=None,
+                        changes=False):
         path = 'bookmarks/list'
         params = {'folder_id': folder, 'limit': limit}
+        # known IDs left out of the request, filtered from the response
+        outside_window = None
         if have:
-            have_concat = ','.join(str(id_) for id_ in have)
-            params['have'] = have_concat
+            if have_window is not None and not isinstance(have, IDSet):
+                have = IDSet(have)
+            if isinstance(have, IDSet):
+                params['have'] = have.joined(have_window)
+                if have_window is not None and len(have) > have_window:
+                    outside_window = have
+            elif isinstance(have, string_types):
+                params['have'] = have
+            else:
+                params['have'] = ','.join(str(id_) for id_ in have)
         response = self.request(path, params)
         items = response['data']
-        bookmarks = []
+        if isinstance(items, dict) and items.get('type') == 'error':
+            raise Exception(items.get('message'))
+        result = {'bookmarks': [], 'highlights': [], 'delete_ids': []}
         for item in items:
             if item.get('type') == 'error':
                 raise Exception(item.get('message'))
             elif item.get('type') == 'bookmark':
-                bookmarks.append(Bookmark(self, **item))
-        return bookmarks
+                if (outside_window is not None and
+                        item.get('bookmark_id') in outside_window):
+                    continue
+                result['bookmarks'].append(Bookmark(self, **item))
+            elif not changes:
+                continue
+            elif item.get('type') == 'highlight':
+                result['highlights'].append(Highlight(self, **item))
+            elif item.get('delete_ids'):
+                result['delete_ids'].extend(_parse_ids(item['delete_ids']))
+        return result
+
+    def watch(self, folders=None, interval=60, **kwargs):
+        """Return a ``Watcher`` emitting change events for folders.
+
+        Call ``start()`` on the result to begin polling in the background,
+        or ``poll()`` to check once.  See ``pyinstapaper.watch.Watcher``
+        for the remaining options.
 
+        :param list folders: Folders to watch, default unread
+        :param float interval: Seconds between polls
+        :rtype: pyinstapaper.watch.Watcher
+        """
+        return Watcher(self, folders, interval, **kwargs)
+
+    @timed('get_folders')
     def get_folders(self):
         """Return list of user's folders.
 
@@ -146,14 +381,16 @@ class InstapaperObject(object):
     :param dict data: key/value pairs of object attributes, e.g. title, etc.
     '''
 
+    @timed('model_init')
     def __init__(self, client, **data):
         self.client = client
         for attrib in self.ATTRIBUTES:
             val = data.get(attrib)
-            if hasattr(self, 'TIMESTAMP_ATTRS'):
+            if hasattr(self, 'TIMESTAMP_ATTRS') and val is not None:
                 if attrib in self.TIMESTAMP_ATTRS:
                     try:
-                        val = datetime.fromtimestamp(int(val))
+                        with stage('fromtimestamp'):
+                            val = datetime.fromtimestamp(int(val))
                     except ValueError:
                         log.warn(
                             'Could not cast %s for %s as datetime',
@@ -170,6 +407,72 @@ class InstapaperObject(object):
                 # ugh, for py2.7 compat
                 instance_method.func_defaults = (action,)
 
+    def to_dict(self):
+        '''Return the object's attributes as a plain, serializable dict.
+
+        Timestamp attributes are converted back to Unix timestamps.
+
+        :rtype: dict
+        '''
+        data = {}
+        for attrib in self.ATTRIBUTES:
+            val = getattr(self, attrib, None)
+            if isinstance(val, datetime):
+                val = _to_timestamp(val)
+            data[attrib] = val
+        return data
+
+    @classmethod
+    def from_dict(cls, data, client=None):
+        '''Build an object from a dict as returned by ``to_dict``.
+
+        :param dict data: key/value pairs of object attributes
+        :param client: Optional ``Instapaper`` instance for making requests
+        '''
+        return cls(client, **data)
+
+    @classmethod
+    def dump(cls, objects, fp, codec='jsonl'):
+        '''Write objects to a binary file in bulk.
+
+        Objects are converted one at a time as the codec consumes them, so
+        the row codecs (jsonl, msgpack) stream without holding every record.
+
+        :param iterable objects: Objects of this class
+        :param fp: File object opened for writing in binary mode
+        :param str codec: One of jsonl (default), msgpack, columnar or arrow
+        '''
+        get_codec(codec).dump(
+            (obj.to_dict() for obj in objects), fp, cls.ATTRIBUTES)
+
+    @classmethod
+    def load(cls, fp, client=None, codec='jsonl'):
+        '''Read objects written by ``dump``.
+
+        Every record becomes a full object, timestamps included; for large
+        snapshots that only feed other systems, ``load_columns`` is cheaper.
+
+        :param fp: File object opened for reading in binary mode
+        :param client: Optional ``Instapaper`` instance for making requests
+        :param str codec: The codec the objects were written with
+        :rtype: list
+        '''
+        return [cls(client, **data) for data in get_codec(codec).load(fp)]
+
+    @classmethod
+    def load_columns(cls, fp, codec='columnar'):
+        '''Read data written by ``dump`` as columns, without building objects.
+
+        Timestamps stay as Unix time.  With the columnar and arrow codecs the
+        columns are decoded in bulk, with no per-record Python work.
+
+        :param fp: File object opened for reading in binary mode
+        :param str codec: The codec the objects were written with
+        :returns: attribute name mapped to a list of values
+        :rtype: dict
+        '''
+        return get_codec(codec).load_columns(fp, cls.ATTRIBUTES)
+
     def add(self):
         '''Save an object to Instapaper after instantiating it.
 
@@ -239,6 +542,20 @@ class Bookmark(InstapaperObject):
     def __str__(self):
         return 'Bookmark %s: %s' % (self.object_id, self.title.encode('utf-8'))
 
+    def have_token(self):
+        '''Return this bookmark's entry for a ``have`` list.
+
+        The ``ID:hash`` form lets the server skip the bookmark unless it has
+        changed since it was fetched.  Progress is deliberately left out, as
+        the server would treat it as a progress update.
+
+        :rtype: str
+        '''
+        if self.hash:
+            return '%s:%s' % (self.object_id, self.hash)
+        return str(self.object_id)
+
+    @timed('get_highlights')
     def get_highlights(self):
         '''Get highlights for Bookmark instance.
 
@@ -254,7 +571,7 @@ class Bookmark(InstapaperObject):
             if item.get('type') == 'error':
                 raise Exception(item.get('message'))
             elif item.get('type') == 'highlight':
-                highlights.append(Highlight(self, **item))
+                highlights.append(Highlight(self.client, **item))
         return highlights
 
 
@@ -312,14 +629,39 @@ class Highlight(InstapaperObject):
     TIMESTAMP_ATTRS = [
         'time',
     ]
-    SIMPLE_ACTIONS = [
-        'delete',
-    ]
+    # highlights are only in API 1.1, whose paths carry the object ID
+    SIMPLE_ACTIONS = []
 
     def __str__(self):
         return 'Highlight %s for Article %s' % (
             self.object_id, self.bookmark_id)
 
     def create(self):
-        # TODO
-        raise NotImplementedError
+        '''Save a new highlight for its bookmark.
+
+        Example::
+
+            highlight = Highlight(instapaper, bookmark_id=123, text='quote')
+            highlight.create()
+
+        :returns: this object, updated with the saved highlight's attributes
+        :raises InstapaperError: e.g. ERROR_DUPLICATE_HIGHLIGHT
+        '''
+        path = '/'.join(['bookmarks', str(self.bookmark_id), 'highlight'])
+        params = {'text': self.text}
+        if self.position is not None:
+            params['position'] = self.position
+        response = self.client.request(path, params, api_version='1.1')
+        for item in response['data']:
+            if item.get('type') == 'highlight':
+                self.__init__(self.client, **item)
+        return self
+
+    def delete(self):
+        '''Delete this highlight.
+
+        :returns: Response from the API
+        :rtype: dict
+        '''
+        path = '/'.join([self.RESOURCE, str(self.object_id), 'delete'])
+        return self.client.request(path, api_version='1.1')
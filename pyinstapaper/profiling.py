@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+'''Opt-in profiling of the client's hot paths.
+
+Stages such as the request delay, OAuth signing, HTTP I/O, JSON decoding and
+model construction are wrapped with :func:`stage`, which does nothing unless
+a :class:`Profiler` is active.  Signing and I/O live in ``oauth2`` and
+``httplib2``, so those are only wrapped while profiling.  Activate a profiler
+with the :func:`profile` context manager::
+
+    from pyinstapaper.profiling import profile
+
+    with profile(stats_file='run.pstats', collapsed_file='run.folded'):
+        instapaper.get_bookmarks('unread', limit=500)
+
+or for a whole process by setting the ``PYINSTAPAPER_PROFILE`` environment
+variable, in which case the report is written to stderr at exit.  If the
+variable's value is a path other than ``1``, it is used as the cProfile
+stats file.
+
+Profiling is safe to use from several threads: stage stacks are kept per
+thread and a profile block may overlap with blocks in other threads, the
+innermost open profiler receiving the stages.  The "net blocks" column is
+the change in live interpreter memory blocks over a stage, as reported by
+``sys.getallocatedblocks``.  It is not a count of allocations, can be
+negative, and is always 0 on python2.
+'''
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+import atexit
+import cProfile
+import os
+import sys
+import threading
+import timeit
+
+import httplib2
+import oauth2 as oauth
+
+PROFILE_ENV_VAR = 'PYINSTAPAPER_PROFILE'
+
+_clock = timeit.default_timer
+# net live blocks; not available on python2
+_allocated_blocks = getattr(sys, 'getallocatedblocks', lambda: 0)
+
+# open profilers, innermost last; guarded by _lock with the instrumentation
+_profilers = []
+_originals = []
+_lock = threading.Lock()
+
+# third-party hot spots wrapped only while a profiler is active:
+# (owner, attribute, stage name)
+_INSTRUMENTED = [
+    (oauth.Request, 'sign_request', 'oauth_sign'),
+    (httplib2.Http, 'request', 'http'),
+]
+
+
+class _NullStage(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._stack().append(self.name)
+        self.blocks = _allocated_blocks()
+        self.start = _clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = _clock() - self.start
+        blocks = _allocated_blocks() - self.blocks
+        stack = self.profiler._stack()
+        self.profiler._record(tuple(stack), elapsed, blocks)
+        stack.pop()
+        return False
+
+
+class Profiler(object):
+    '''Accumulates wall time and net allocated blocks per stage.
+
+    Stages nest, so time is tracked per stage path, e.g.
+    ``('get_bookmarks', 'request', 'transport')``.
+
+    :param bool use_cprofile: Also run ``cProfile`` for the duration
+    '''
+
+    def __init__(self, use_cprofile=False):
+        self.calls = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.blocks = defaultdict(int)
+        self._local = threading.local()
+        self._record_lock = threading.Lock()
+        self._cprofile = cProfile.Profile() if use_cprofile else None
+        self._start = None
+        self.elapsed = 0.0
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _record(self, path, elapsed, blocks):
+        with self._record_lock:
+            self.calls[path] += 1
+            self.seconds[path] += elapsed
+            self.blocks[path] += blocks
+
+    def start(self):
+        self._start = _clock()
+        if self._cprofile:
+            self._cprofile.enable()
+
+    def stop(self):
+        if self._cprofile:
+            self._cprofile.disable()
+        self.elapsed += _clock() - self._start
+
+    def self_seconds(self, path):
+        '''Return time spent in a stage path excluding nested stages.'''
+        children = sum(
+            secs for child, secs in self.seconds.items()
+            if len(child) == len(path) + 1 and child[:len(path)] == path
+        )
+        return self.seconds[path] - children
+
+    def report(self, stream=None):
+        '''Write a per-stage breakdown of time and net allocated blocks.
+
+        :param stream: File-like object, defaults to ``sys.stderr``
+        '''
+        stream = stream or sys.stderr
+        stream.write('pyinstapaper profile: %.4fs total\n' % self.elapsed)
+        stream.write('%-48s %8s %10s %10s %12s\n' % (
+            'stage', 'calls', 'total s', 'self s', 'net blocks'))
+        for path in sorted(self.seconds):
+            name = '  ' * (len(path) - 1) + path[-1]
+            stream.write('%-48s %8d %10.4f %10.4f %12d\n' % (
+                name, self.calls[path], self.seconds[path],
+                self.self_seconds(path), self.blocks[path]))
+
+    def dump_stats(self, filename):
+        '''Write cProfile data readable by ``pstats.Stats``.'''
+        if not self._cprofile:
+            raise ValueError('Profiler was created without use_cprofile')
+        self._cprofile.dump_stats(filename)
+
+    def dump_collapsed(self, filename):
+        '''Write stage self-times as flamegraph collapsed stacks.
+
+        Each line is ``stage;nested_stage <microseconds>``, the input format
+        of ``flamegraph.pl`` and speedscope.
+        '''
+        with open(filename, 'w') as out:
+            for path in sorted(self.seconds):
+                micros = int(round(self.self_seconds(path) * 1e6))
+                if micros > 0:
+                    out.write('%s %d\n' % (';'.join(path), micros))
+
+
+def stage(name):
+    '''Return a context manager timing ``name`` on the active profiler.
+
+    :param str name: Stage label, e.g. "json"
+    '''
+    try:
+        return _Stage(_profilers[-1], name)
+    except IndexError:
+        return _NULL_STAGE
+
+
+def timed(name):
+    '''Decorator form of :func:`stage`.'''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _activate(profiler):
+    with _lock:
+        if not _profilers:
+            for owner, attr, name in _INSTRUMENTED:
+                original = owner.__dict__[attr]
+                _originals.append((owner, attr, original))
+                setattr(owner, attr, timed(name)(original))
+        _profilers.append(profiler)
+
+
+def _deactivate(profiler):
+    with _lock:
+        _profilers.remove(profiler)
+        if not _profilers:
+            while _originals:
+                owner, attr, original = _originals.pop()
+                setattr(owner, attr, original)
+
+
+@contextmanager
+def profile(stats_file=None, collapsed_file=None, stream=None, report=True):
+    '''Profile the client for the duration of the block.
+
+    :param str stats_file: Optional path for a cProfile/pstats dump
+    :param str collapsed_file: Optional path for collapsed-stack output
+    :param stream: Where to write the report, defaults to ``sys.stderr``
+    :param bool report: Set False to skip writing the report
+    :returns: the active :class:`Profiler`
+    '''
+    profiler = Profiler(use_cprofile=bool(stats_file))
+    _activate(profiler)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        _deactivate(profiler)
+        if report:
+            profiler.report(stream)
+        if stats_file:
+            profiler.dump_stats(stats_file)
+        if collapsed_file:
+            profiler.dump_collapsed(collapsed_file)
+
+
+def _profile_from_env():
+    value = os.environ.get(PROFILE_ENV_VAR)
+    if not value or value == '0':
+        return
+    stats_file = value if value != '1' else None
+    ctx = profile(stats_file=stats_file)
+    ctx.__enter__()
+    atexit.register(ctx.__exit__, None, None, None)
+
+
+_profile_from_env()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+'''Codecs for bulk export and import of Instapaper objects.
+
+Codecs work on plain dicts as produced by ``InstapaperObject.to_dict``, so
+they are normally used through ``InstapaperObject.dump`` and ``load``::
+
+    with open('bookmarks.msgpack', 'wb') as fp:
+        Bookmark.dump(bookmarks, fp, codec='msgpack')
+
+    with open('bookmarks.msgpack', 'rb') as fp:
+        bookmarks = Bookmark.load(fp, instapaper, codec='msgpack')
+
+For exports that feed other systems, ``InstapaperObject.load_columns``
+returns a dict of columns instead of objects; with the columnar and arrow
+codecs that is decoded in bulk without per-record Python work.
+
+All codecs read and write binary file objects.  Additional codecs can be
+added with :func:`register_codec`.
+'''
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+CODECS = {}
+
+
+def register_codec(name, codec):
+    '''Make a codec available by name to ``dump`` and ``load``.
+
+    :param str name: Name to register the codec under, e.g. "jsonl"
+    :param codec: Object with ``dump(records, fp, fields)``, ``load(fp)`` and
+        ``load_columns(fp, fields)``
+    '''
+    CODECS[name] = codec
+
+
+def get_codec(name):
+    '''Return the codec registered under ``name``.'''
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError('Unknown codec %r, expected one of: %s' % (
+            name, ', '.join(sorted(CODECS))))
+
+
+def to_columns(records, fields):
+    '''Pivot an iterable of dicts into a dict of equal-length column lists.
+
+    Records are consumed in a single pass.  The result can be passed straight
+    to ``pyarrow.RecordBatch.from_pydict`` or ``pandas.DataFrame``.
+    '''
+    columns = dict((field, []) for field in fields)
+    appends = [(field, columns[field].append) for field in columns]
+    for record in records:
+        for field, append in appends:
+            append(record.get(field))
+    return columns
+
+
+def from_columns(columns):
+    '''Inverse of :func:`to_columns`.'''
+    fields = list(columns)
+    return [dict(zip(fields, row)) for row in zip(*columns.values())]
+
+
+class _RowCodec(object):
+
+    def load_columns(self, fp, fields):
+        return to_columns(self.load(fp), fields)
+
+
+class JSONLinesCodec(_RowCodec):
+
+    '''One compact JSON object per line.'''
+
+    def dump(self, records, fp, fields):
+        for record in records:
+            fp.write(json.dumps(record, separators=(',', ':')).encode('utf-8'))
+            fp.write(b'\n')
+
+    def load(self, fp):
+        for line in fp:
+            line = line.strip()
+            if line:
+                yield json.loads(line.decode('utf-8'))
+
+
+class MsgpackCodec(_RowCodec):
+
+    '''A stream of MessagePack maps. Requires the ``msgpack`` package.'''
+
+    def _check(self):
+        if msgpack is None:
+            raise ImportError('The msgpack codec requires msgpack')
+
+    def dump(self, records, fp, fields):
+        self._check()
+        packer = msgpack.Packer(use_bin_type=True)
+        for record in records:
+            fp.write(packer.pack(record))
+
+    def load(self, fp):
+        self._check()
+        return msgpack.Unpacker(fp, raw=False)
+
+
+class ColumnarCodec(object):
+
+    '''A single JSON document holding one list per attribute.'''
+
+    def dump(self, records, fp, fields):
+        columns = to_columns(records, fields)
+        fp.write(json.dumps(columns, separators=(',', ':')).encode('utf-8'))
+
+    def load(self, fp):
+        return from_columns(self.load_columns(fp, None))
+
+    def load_columns(self, fp, fields):
+        return json.loads(fp.read().decode('utf-8'))
+
+
+class ArrowCodec(object):
+
+    '''An Arrow IPC stream of record batches. Requires ``pyarrow``.'''
+
+    def _check(self):
+        if pyarrow is None:
+            raise ImportError('The arrow codec requires pyarrow')
+
+    def dump(self, records, fp, fields):
+        self._check()
+        batch = pyarrow.RecordBatch.from_pydict(to_columns(records, fields))
+        writer = pyarrow.ipc.new_stream(fp, batch.schema)
+        writer.write_batch(batch)
+        writer.close()
+
+    def load(self, fp):
+        self._check()
+        return pyarrow.ipc.open_stream(fp).read_all().to_pylist()
+
+    def load_columns(self, fp, fields):
+        self._check()
+        return pyarrow.ipc.open_stream(fp).read_all().to_pydict()
+
+
+register_codec('jsonl', JSONLinesCodec())
+register_codec('msgpack', MsgpackCodec())
+register_codec('columnar', ColumnarCodec())
+register_codec('arrow', ArrowCodec())
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+'''Two-way highlight sync that only refetches bookmarks that changed.
+
+:class:`HighlightSync` keeps a local :class:`HighlightStore` of highlights by
+``highlight_id``, plus each bookmark's ``hash`` and ``progress_timestamp`` as
+of the last sync.  Known bookmarks are sent to Instapaper as ``ID:hash``
+pairs, so only new or changed bookmarks come back, and highlights are
+fetched for those alone::
+
+    store = HighlightStore()
+    sync = HighlightSync(instapaper, store, folders=['unread', 'archive'])
+    stats = sync.pull()
+    sync.push([Highlight(instapaper, bookmark_id=123, text='a quote')])
+    sync.delete([456, 789])
+
+Each run returns a :class:`SyncStats` with API calls made and saved and the
+highlight throughput; all runs are kept in ``HighlightSync.runs``.
+'''
+import json
+import logging
+import timeit
+
+from pyinstapaper.instapaper import (
+    ERROR_DUPLICATE_HIGHLIGHT, Bookmark, Highlight, InstapaperError)
+
+log = logging.getLogger(__name__)
+
+_clock = timeit.default_timer
+
+
+class HighlightStore(object):
+    '''Local copy of highlights and the bookmark state they were synced at.
+
+    ``highlights`` maps highlight_id to ``Highlight`` and ``bookmarks`` maps
+    bookmark_id to a ``(hash, progress_timestamp, folder)`` tuple, the
+    timestamp in Unix time.
+    '''
+
+    def __init__(self):
+        self.highlights = {}
+        self.bookmarks = {}
+        self._by_bookmark = {}
+
+    def add(self, highlight):
+        '''Store a highlight, replacing any with the same ID.'''
+        self.remove(highlight.object_id)
+        self.highlights[highlight.object_id] = highlight
+        self._by_bookmark.setdefault(
+            highlight.bookmark_id, set()).add(highlight.object_id)
+
+    def remove(self, highlight_id):
+        '''Drop a highlight if it is stored.'''
+        highlight = self.highlights.pop(highlight_id, None)
+        if highlight is not None:
+            self._by_bookmark[highlight.bookmark_id].discard(highlight_id)
+
+    def for_bookmark(self, bookmark_id):
+        '''Return the stored highlights of one bookmark.'''
+        return [self.highlights[highlight_id] for highlight_id in
+                self._by_bookmark.get(bookmark_id, ())]
+
+    def dump(self, fp):
+        '''Write the store as JSON to a text file object.'''
+        json.dump({
+            'highlights': [h.to_dict() for h in self.highlights.values()],
+            'bookmarks': [[bookmark_id] + list(state) for
+                          bookmark_id, state in self.bookmarks.items()],
+        }, fp)
+
+    @classmethod
+    def load(cls, fp, client=None):
+        '''Read a store written by ``dump``.
+
+        :param fp: Text file object
+        :param client: ``Instapaper`` instance for the loaded highlights
+        '''
+        data = json.load(fp)
+        store = cls()
+        for item in data['highlights']:
+            store.add(Highlight.from_dict(item, client))
+        for row in data['bookmarks']:
+            store.bookmarks[row[0]] = tuple(row[1:])
+        return store
+
+
+class SyncStats(object):
+    '''Counters for one sync run.
+
+    ``api_calls_saved`` counts highlight fetches skipped because the
+    bookmark had not changed since the last sync.
+    '''
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.api_calls = 0
+        self.api_calls_saved = 0
+        self.bookmarks_changed = 0
+        self.highlights = 0
+        self.conflicts = []
+        self.failures = []
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self):
+        '''Highlights processed per second.'''
+        return self.highlights / self.elapsed if self.elapsed else 0.0
+
+    def __repr__(self):
+        return ('<SyncStats %s: %d highlights, %d API calls, %d saved, '
+                '%d conflicts, %.1f/s>' % (
+                    self.operation, self.highlights, self.api_calls,
+                    self.api_calls_saved, len(self.conflicts),
+                    self.throughput))
+
+
+def _bookmark_state(bookmark, folder):
+    data = bookmark.to_dict()
+    return (data['hash'], data['progress_timestamp'], folder)
+
+
+class HighlightSync(object):
+    '''Keep a :class:`HighlightStore` in sync with Instapaper.
+
+    :param client: Logged in ``Instapaper`` instance
+    :param store: Optional :class:`HighlightStore`, a new one by default
+    :param list folders: Folders whose bookmarks' highlights are synced
+    :param int limit: Maximum bookmarks to request per folder and run
+    '''
+
+    def __init__(self, client, store=None, folders=None, limit=500):
+        self.client = client
+        self.store = store if store is not None else HighlightStore()
+        self.folders = list(folders or ['unread', 'archive'])
+        self.limit = limit
+        self.runs = []
+
+    def _finish(self, stats, start):
+        stats.elapsed = _clock() - start
+        self.runs.append(stats)
+        log.info('Highlight sync: %r', stats)
+        return stats
+
+    def _remote_highlights(self, bookmark_id, stats):
+        stats.api_calls += 1
+        return Bookmark(self.client, bookmark_id=bookmark_id).get_highlights()
+
+    def _forget_bookmark(self, bookmark_id):
+        self.store.bookmarks.pop(bookmark_id, None)
+        for highlight in self.store.for_bookmark(bookmark_id):
+            self.store.remove(highlight.object_id)
+
+    def pull(self):
+        '''Fetch highlights for bookmarks that changed since the last pull.
+
+        :rtype: SyncStats
+        '''
+        stats = SyncStats('pull')
+        start = _clock()
+        unchanged = set(self.store.bookmarks)
+        for folder in self.folders:
+            # have lists are per folder, or the server would report every
+            # other folder's bookmarks as deleted from this one
+            have = ['%s:%s' % (bookmark_id, state[0]) if state[0]
+                    else bookmark_id
+                    for bookmark_id, state in self.store.bookmarks.items()
+                    if state[2] == folder]
+            stats.api_calls += 1
+            changes = self.client.get_bookmark_changes(
+                folder, self.limit, have)
+            for bookmark_id in changes['delete_ids']:
+                state = self.store.bookmarks.get(bookmark_id)
+                if state is not None and state[2] == folder:
+                    unchanged.discard(bookmark_id)
+                    self._forget_bookmark(bookmark_id)
+            for bookmark in changes['bookmarks']:
+                unchanged.discard(bookmark.object_id)
+                state = _bookmark_state(bookmark, folder)
+                known = self.store.bookmarks.get(bookmark.object_id)
+                self.store.bookmarks[bookmark.object_id] = state
+                if known is not None and known[:2] == state[:2]:
+                    # moved between folders, or the server ignored the hash
+                    continue
+                stats.bookmarks_changed += 1
+                remote = dict(
+                    (h.object_id, h) for h in
+                    self._remote_highlights(bookmark.object_id, stats))
+                for highlight in self.store.for_bookmark(bookmark.object_id):
+                    if highlight.object_id not in remote:
+                        self.store.remove(highlight.object_id)
+                for highlight in remote.values():
+                    self.store.add(highlight)
+                stats.highlights += len(remote)
+        stats.api_calls_saved = len(unchanged)
+        return self._finish(stats, start)
+
+    def push(self, highlights):
+        '''Create highlights remotely and add them to the store.
+
+        A highlight whose text already exists on its bookmark, locally or
+        remotely, is a conflict: the remote copy wins and is stored instead.
+
+        :param list highlights: Unsaved ``Highlight`` objects
+        :rtype: SyncStats
+        '''
+        stats = SyncStats('push')
+        start = _clock()
+        for highlight in highlights:
+            local = [h for h in self.store.for_bookmark(highlight.bookmark_id)
+                     if h.text == highlight.text]
+            if local:
+                stats.conflicts.append((highlight, 'duplicate'))
+                continue
+            highlight.client = self.client
+            stats.api_calls += 1
+            try:
+                highlight.create()
+            except InstapaperError as exc:
+                if exc.error_code != ERROR_DUPLICATE_HIGHLIGHT:
+                    stats.failures.append((highlight, exc))
+                    continue
+                stats.conflicts.append((highlight, 'duplicate'))
+                for remote in self._remote_highlights(
+                        highlight.bookmark_id, stats):
+                    self.store.add(remote)
+                continue
+            self.store.add(highlight)
+            stats.highlights += 1
+        return self._finish(stats, start)
+
+    def delete(self, highlight_ids):
+        '''Delete highlights remotely and from the store.
+
+        If Instapaper refuses a delete, the bookmark's highlights are fetched
+        again: a highlight that is already gone remotely is a conflict that
+        resolves to deleting it locally, anything else is a failure.
+
+        :param list highlight_ids: IDs of highlights in the store
+        :rtype: SyncStats
+        '''
+        stats = SyncStats('delete')
+        start = _clock()
+        for highlight_id in highlight_ids:
+            highlight = self.store.highlights.get(highlight_id)
+            if highlight is None:
+                stats.conflicts.append((highlight_id, 'unknown'))
+                continue
+            highlight.client = self.client
+            stats.api_calls += 1
+            try:
+                highlight.delete()
+            except InstapaperError as exc:
+                remote = self._remote_highlights(highlight.bookmark_id, stats)
+                if highlight_id in [h.object_id for h in remote]:
+                    stats.failures.append((highlight_id, exc))
+                    continue
+                stats.conflicts.append((highlight_id, 'already deleted'))
+            self.store.remove(highlight_id)
+            stats.highlights += 1
+        return self._finish(stats, start)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+'''Pluggable HTTP transports for ``Instapaper.request``.
+
+``Instapaper.request`` builds the URL and form body and hands them to its
+transport, which returns ``(response_headers, content)``.  The default,
+``pyinstapaper.instapaper.OAuthTransport``, signs and sends requests with
+``oauth2``.  :class:`Recorder` wraps another transport and writes every
+exchange, with its latency, to a cassette file; :class:`Replayer` serves a
+cassette back without touching the network::
+
+    transport = Recorder(OAuthTransport(), 'bookmarks.jsonl.gz')
+    instapaper = Instapaper(KEY, SECRET, transport=transport)
+    ...
+    transport.close()
+
+    # later, offline, at the recorded speed
+    instapaper = Instapaper(KEY, SECRET, request_delay=0,
+                            transport=Replayer('bookmarks.jsonl.gz', speed=1))
+
+Cassettes are JSON Lines, gzipped when the file name ends in ``.gz``.  The
+first line is a header, each further line one exchange.  Usernames,
+passwords and OAuth token secrets are replaced with ``REDACTED`` before they
+are written.
+'''
+from collections import defaultdict, deque
+
+import base64
+import gzip
+import io
+import json
+import threading
+import time
+import timeit
+
+import httplib2
+
+# for python2/3 compat
+from future.moves.urllib.parse import parse_qsl, urlencode
+
+CASSETTE_VERSION = 1
+ACCESS_TOKEN_PATH = 'oauth/access_token'
+REDACTED = 'REDACTED'
+# form fields and response fields never written to a cassette
+SENSITIVE_FIELDS = frozenset([
+    'x_auth_username', 'x_auth_password', 'oauth_token',
+    'oauth_token_secret',
+])
+
+_clock = timeit.default_timer
+
+
+class CassetteError(Exception):
+    '''A replayed request has no matching recorded exchange.'''
+
+
+class Transport(object):
+    '''Interface for objects that send requests for ``Instapaper``.'''
+
+    def request(self, instapaper, uri, method='POST', body=None):
+        '''Send a request.
+
+        :param instapaper: The ``Instapaper`` instance making the request
+        :param str uri: Full URL of the API endpoint
+        :param str method: HTTP method
+        :param str body: urlencoded form body, if any
+        :returns: response headers (a dict with "status") and content bytes
+        :rtype: tuple
+        '''
+        raise NotImplementedError
+
+
+def redact(body):
+    '''Return a urlencoded body with sensitive field values replaced.'''
+    if not body:
+        return body
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    fields = parse_qsl(body, keep_blank_values=True)
+    if not any(key in SENSITIVE_FIELDS for key, _ in fields):
+        return body
+    return urlencode([
+        (key, REDACTED if key in SENSITIVE_FIELDS else value)
+        for key, value in fields
+    ])
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(path, mode + 'b'), encoding='utf-8')
+    return io.open(path, mode, encoding='utf-8')
+
+
+def _encode_content(content):
+    try:
+        return {'text': content.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {'base64': base64.b64encode(content).decode('ascii')}
+
+
+def _decode_content(data):
+    if 'text' in data:
+        return data['text'].encode('utf-8')
+    return base64.b64decode(data['base64'])
+
+
+class Recorder(Transport):
+    '''Record every exchange made through another transport to a cassette.
+
+    Safe to share between threads.  Call :meth:`close`, or use the recorder
+    as a context manager, to flush the file.
+
+    :param transport: The transport that actually sends requests
+    :param str path: Cassette file to write; ``.gz`` for gzip
+    '''
+
+    def __init__(self, transport, path):
+        self.transport = transport
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = _open(path, 'w')
+        self._write({'version': CASSETTE_VERSION, 'recorded': time.time()})
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(',', ':'), sort_keys=True)
+        with self._lock:
+            self._file.write(line + u'\n')
+
+    def request(self, instapaper, uri, method='POST', body=None):
+        start = _clock()
+        response, content = self.transport.request(
+            instapaper, uri, method=method, body=body)
+        elapsed = _clock() - start
+        record = {
+            'method': method,
+            'uri': uri,
+            'body': redact(body),
+            'headers': dict(response),
+            'elapsed': round(elapsed, 6),
+        }
+        recorded = content
+        if uri.endswith(ACCESS_TOKEN_PATH):
+            recorded = redact(content).encode('utf-8')
+        record.update(_encode_content(recorded))
+        self._write(record)
+        return response, content
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Replayer(Transport):
+    '''Serve requests from a cassette written by :class:`Recorder`.
+
+    Requests are matched on method, URL and (redacted) body.  Repeated
+    identical requests, e.g. successive polls, get the recorded responses
+    in order.
+
+    :param str path: Cassette file to read
+    :param float speed: None (default) to answer immediately, 1 to sleep for
+        each exchange's recorded latency, 2 for half of it, and so on
+    '''
+
+    def __init__(self, path, speed=None):
+        self.path = path
+        self.speed = speed
+        self.exchanges = []
+        self._pending = defaultdict(deque)
+        self._lock = threading.Lock()
+        with _open(path, 'r') as cassette:
+            header = json.loads(cassette.readline())
+            if header.get('version') != CASSETTE_VERSION:
+                raise CassetteError(
+                    'Unsupported cassette version %r' % header.get('version'))
+            for line in cassette:
+                exchange = json.loads(line)
+                self.exchanges.append(exchange)
+                self._pending[self._key(
+                    exchange['method'], exchange['uri'], exchange['body'])
+                ].append(exchange)
+
+    @staticmethod
+    def _key(method, uri, body):
+        return method, uri, redact(body) or None
+
+    @property
+    def recorded_seconds(self):
+        '''Total latency of the recorded exchanges.'''
+        return sum(exchange['elapsed'] for exchange in self.exchanges)
+
+    def request(self, instapaper, uri, method='POST', body=None):
+        key = self._key(method, uri, body)
+        with self._lock:
+            try:
+                exchange = self._pending[key].popleft()
+            except IndexError:
+                raise CassetteError('No recorded response for %s %s %s' % key)
+        if self.speed:
+            time.sleep(exchange['elapsed'] / self.speed)
+        return httplib2.Response(exchange['headers']), \
+            _decode_content(exchange)
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+'''Poll folders for changes and fan them out as events.
+
+A single :class:`Watcher` keeps the last known state of each folder and
+sends it back to Instapaper as a ``have`` list of ``ID:hash`` pairs, so each
+poll only downloads new or changed bookmarks.  Changes are turned into
+:class:`WatchEvent` tuples and delivered to every subscriber::
+
+    watcher = instapaper.watch(['unread', 'starred'], interval=60)
+    watcher.subscribe(handle_event, types=[ADDED, STARRED])
+    watcher.start()
+
+    # or, from asyncio code
+    async for event in watcher:
+        ...
+
+When a poll finds nothing new, or fails, the interval doubles up to
+``max_interval`` and drops back to ``interval`` as soon as something changes.
+'''
+from collections import namedtuple
+
+import logging
+import threading
+
+from future.moves.queue import Queue
+
+ADDED = 'added'
+REMOVED = 'removed'
+STARRED = 'starred'
+UNSTARRED = 'unstarred'
+PROGRESS_CHANGED = 'progress_changed'
+HIGHLIGHT_ADDED = 'highlight_added'
+
+EVENT_TYPES = (
+    ADDED, REMOVED, STARRED, UNSTARRED, PROGRESS_CHANGED, HIGHLIGHT_ADDED)
+
+log = logging.getLogger(__name__)
+
+WatchEvent = namedtuple(
+    'WatchEvent', ['type', 'folder', 'bookmark', 'previous', 'highlight'])
+WatchEvent.__doc__ = '''A change seen by a :class:`Watcher`.
+
+``bookmark`` is the current ``Bookmark`` (None for removals, where only
+``previous`` is set), ``previous`` the last known version and ``highlight``
+the new ``Highlight`` for highlight_added events.
+'''
+
+_STOP = object()
+
+
+class Watcher(object):
+    '''Poll one or more folders and emit change events to subscribers.
+
+    :param client: Logged in ``Instapaper`` instance
+    :param list folders: Folders to watch, e.g. unread, starred or folder IDs
+    :param float interval: Seconds between polls while things are changing
+    :param float max_interval: Upper bound for the backed-off interval,
+        defaults to eight times ``interval``
+    :param int limit: Maximum bookmarks to request per folder and poll
+    :param bool highlights: Also fetch highlights for new and changed
+        bookmarks and emit highlight_added events
+    :param bool emit_initial: Emit added events for everything found on the
+        first poll instead of silently recording it
+    :param int have_window: Optional. Only send the newest ``have_window``
+        known bookmarks as ``have``; older ones the server returns again are
+        compared and ignored if unchanged, but their removal goes unnoticed
+
+    ``poll`` may be called from any thread, including while ``start`` is
+    running; polls are serialized.  Subscriber callbacks run on the polling
+    thread and must not block for long.
+    '''
+
+    def __init__(self, client, folders=None, interval=60, max_interval=None,
+                 limit=500, highlights=False, emit_initial=False,
+                 have_window=None):
+        self.client = client
+        self.folders = list(folders or ['unread'])
+        self.interval = interval
+        self.max_interval = max_interval or interval * 8
+        self.current_interval = interval
+        self.limit = limit
+        self.highlights = highlights
+        self.emit_initial = emit_initial
+        self.have_window = have_window
+        self._state = {}
+        # joined have string per folder, rebuilt only after changes
+        self._have = {}
+        self._highlights = {}
+        self._subscribers = []
+        self._queues = []
+        self._lock = threading.Lock()
+        self._poll_lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback, types=None):
+        '''Call ``callback(event)`` for each event, optionally filtered.
+
+        :param callable callback: Function taking a single ``WatchEvent``
+        :param list types: Optional event types to deliver, default all
+        :returns: the callback, for use with ``unsubscribe``
+        '''
+        with self._lock:
+            self._subscribers.append((callback, types))
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [
+                sub for sub in self._subscribers if sub[0] is not callback]
+
+    def events(self, types=None):
+        '''Iterate over events as they arrive, blocking between them.
+
+        Iteration ends when the watcher is stopped.  Events are buffered
+        from the moment this is called until the iterator is closed or
+        garbage collected.
+
+        :param list types: Optional event types to deliver, default all
+        '''
+        return _EventIterator(self, types)
+
+    def aevents(self, types=None):
+        '''Async iterator over events, for use with ``async for``.
+
+        Must be called with an asyncio event loop running.  Leaving the loop
+        early (``break`` or cancellation) unsubscribes the consumer.
+
+        :param list types: Optional event types to deliver, default all
+        '''
+        # imported here as asyncio is python3 only
+        from pyinstapaper._async_watch import aiter_events
+        return aiter_events(self, types)
+
+    def __aiter__(self):
+        return self.aevents()
+
+    def _add_queue(self, queue, types):
+        with self._lock:
+            self._queues.append((queue, types))
+
+    def _remove_queue(self, queue):
+        with self._lock:
+            self._queues = [q for q in self._queues if q[0] is not queue]
+
+    def _emit(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            queues = list(self._queues)
+        for callback, types in subscribers:
+            if types is None or event.type in types:
+                try:
+                    callback(event)
+                except Exception:
+                    log.exception('Watch subscriber %r failed', callback)
+        for queue, types in queues:
+            if types is None or event.type in types:
+                queue.put(event)
+
+    def poll(self):
+        '''Check every folder once and emit any changes.
+
+        :returns: the events emitted
+        :rtype: list
+        '''
+        with self._poll_lock:
+            priming = any(f not in self._state for f in self.folders)
+            events = []
+            for folder in self.folders:
+                events.extend(self._poll_folder(folder))
+            for event in events:
+                self._emit(event)
+            if events or priming:
+                self.current_interval = self.interval
+            else:
+                self._back_off()
+            return events
+
+    def _back_off(self):
+        self.current_interval = min(
+            self.current_interval * 2, self.max_interval)
+
+    def _poll_folder(self, folder):
+        priming = folder not in self._state
+        state = self._state.setdefault(folder, {})
+        have = self._have.get(folder)
+        if have is None:
+            ids = sorted(state, reverse=True)[:self.have_window]
+            have = ','.join(state[id_].have_token() for id_ in ids)
+            self._have[folder] = have
+        changes = self.client.get_bookmark_changes(folder, self.limit, have)
+        if changes['bookmarks'] or changes['delete_ids']:
+            self._have.pop(folder, None)
+        events = []
+        changed = []
+        for bookmark in changes['bookmarks']:
+            previous = state.get(bookmark.object_id)
+            state[bookmark.object_id] = bookmark
+            changed.append(bookmark)
+            if previous is None:
+                events.append(
+                    WatchEvent(ADDED, folder, bookmark, None, None))
+                continue
+            if _is_starred(previous) != _is_starred(bookmark):
+                event_type = STARRED if _is_starred(bookmark) else UNSTARRED
+                events.append(
+                    WatchEvent(event_type, folder, bookmark, previous, None))
+            if (previous.progress != bookmark.progress or
+                    previous.progress_timestamp !=
+                    bookmark.progress_timestamp):
+                events.append(WatchEvent(
+                    PROGRESS_CHANGED, folder, bookmark, previous, None))
+        for bookmark_id in changes['delete_ids']:
+            previous = state.pop(bookmark_id, None)
+            if previous is not None:
+                events.append(
+                    WatchEvent(REMOVED, folder, None, previous, None))
+        highlights = list(changes['highlights'])
+        # on a silent priming poll the per-bookmark fetches would only
+        # record what is already there, so skip them
+        if self.highlights and (self.emit_initial or not priming):
+            for bookmark in changed:
+                highlights.extend(bookmark.get_highlights())
+        for highlight in highlights:
+            if highlight.object_id in self._highlights:
+                continue
+            bookmark = state.get(highlight.bookmark_id)
+            self._highlights[highlight.object_id] = highlight
+            events.append(WatchEvent(
+                HIGHLIGHT_ADDED, folder, bookmark, None, highlight))
+        if priming and not self.emit_initial:
+            return []
+        return events
+
+    def run(self):
+        '''Poll until ``stop`` is called, backing off while idle.'''
+        while not self._stopped.is_set():
+            try:
+                self.poll()
+            except Exception:
+                log.exception('Watch poll failed')
+                self._back_off()
+            self._stopped.wait(self.current_interval)
+
+    def start(self):
+        '''Start polling in a background daemon thread.'''
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''Stop polling and end any ``events`` iterators.'''
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            queues = list(self._queues)
+        for queue, _ in queues:
+            queue.put(_STOP)
+
+
+def _is_starred(bookmark):
+    return str(bookmark.starred) == '1'
+
+
+class _EventIterator(object):
+
+    '''Blocking iterator over a watcher's events, one queue per consumer.'''
+
+    def __init__(self, watcher, types):
+        self.watcher = watcher
+        self.queue = Queue()
+        watcher._add_queue(self.queue, types)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        event = self.queue.get()
+        if event is _STOP:
+            self.close()
+            raise StopIteration
+        return event
+
+    next = __next__  # python2
+
+    def close(self):
+        '''Stop receiving events.'''
+        self.watcher._remove_queue(self.queue)
+
+    def __del__(self):
+        self.close()
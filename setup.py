@@ -20,6 +20,11 @@ requirements = [
     'requests>=2.7,<3',
 ]
 
+extra_requirements = {
+    'msgpack': ['msgpack'],
+    'arrow': ['pyarrow'],
+}
+
 setup_requirements = ['pytest-runner', ]
 
 test_requirements = ['pytest', ]
@@ -46,6 +51,7 @@ setup(
         # ],
     },
     install_requires=requirements,
+    extras_require=extra_requirements,
     license="MIT license",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_concurrency
+----------------------------------
+
+Stress tests sharing one `Instapaper` client between threads, against a
+local fake API server.
+"""
+
+import json
+import threading
+import time
+import unittest
+
+from future.moves.http.server import BaseHTTPRequestHandler, HTTPServer
+from future.moves.socketserver import ThreadingMixIn
+from future.moves.urllib.parse import parse_qsl
+from mock import patch
+
+from pyinstapaper.instapaper import Instapaper, RateLimiter
+
+THREADS = 32
+CALLS_PER_THREAD = 4
+SERVER_LATENCY_SECS = 0.02
+
+
+class FakeInstapaperHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):  # noqa
+        length = int(self.headers.get('Content-Length') or 0)
+        params = dict(parse_qsl(self.rfile.read(length).decode()))
+        time.sleep(SERVER_LATENCY_SECS)
+        if self.path.endswith('oauth/access_token'):
+            body = b'oauth_token_secret=abc&oauth_token=xyz'
+        elif self.path.endswith('bookmarks/list'):
+            # echo the folder back so callers can spot crossed responses
+            body = json.dumps([
+                {'type': 'meta'},
+                {'type': 'bookmark', 'bookmark_id': 1, 'hash': 'x',
+                 'title': params['folder_id'], 'time': 1444260591,
+                 'progress_timestamp': 0, 'starred': '0'},
+            ]).encode()
+        elif self.path.endswith('bookmarks/star'):
+            body = json.dumps([
+                {'type': 'bookmark', 'bookmark_id': int(params['bookmark_id']),
+                 'starred': '1'},
+            ]).encode()
+        elif self.path.endswith('bookmarks/get_text'):
+            body = b'<html><p>%s</p></html>' % params['bookmark_id'].encode()
+        else:
+            body = json.dumps([
+                {'type': 'folder', 'folder_id': 9, 'title': 'Stuff'},
+            ]).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeInstapaperServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 64
+
+
+class TestConcurrency(unittest.TestCase):
+
+    def setUp(self):  # noqa
+        self.server = FakeInstapaperServer(
+            ('127.0.0.1', 0), FakeInstapaperHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        base_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.base_url_patch = patch(
+            'pyinstapaper.instapaper.BASE_URL', base_url)
+        self.base_url_patch.start()
+        self.client = Instapaper('KEY', 'SECRET', request_delay=0)
+        self.client.login('USERNAME', 'PASSWORD')
+
+    def _run(self, threads):
+        errors = []
+        calls = THREADS * CALLS_PER_THREAD // threads
+
+        def worker(worker_id):
+            for call in range(calls):
+                try:
+                    if call % 2:
+                        folders = self.client.get_folders()
+                        assert folders[0].title == 'Stuff'
+                    else:
+                        folder = 'w%d-%d' % (worker_id, call)
+                        bookmarks = self.client.get_bookmarks(folder)
+                        assert [b.title for b in bookmarks] == [folder], \
+                            (folder, bookmarks)
+                except Exception as exc:
+                    errors.append(exc)
+
+        workers = [threading.Thread(target=worker, args=(i,))
+                   for i in range(threads)]
+        start = time.time()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.time() - start
+        self.assertEqual(errors, [])
+        return THREADS * CALLS_PER_THREAD / elapsed
+
+    def test_shared_client_threads(self):
+        serial = self._run(1)
+        parallel = self._run(THREADS)
+        # at least a few times faster than one thread making every call
+        self.assertGreater(parallel, serial * 4)
+        self.assertEqual(self.client.token.key, 'xyz')
+
+    def test_rate_limiter_spaces_threads(self):
+        limiter = RateLimiter(0.02)
+        stamps = []
+
+        def worker():
+            limiter.wait()
+            stamps.append(time.time())
+
+        workers = [threading.Thread(target=worker) for _ in range(10)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        stamps.sort()
+        self.assertGreaterEqual(stamps[-1] - stamps[0], 0.02 * 9 * 0.9)
+
+    def tearDown(self):  # noqa
+        self.base_url_patch.stop()
+        self.server.shutdown()
+        self.server.server_close()
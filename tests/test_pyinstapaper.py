@@ -8,11 +8,27 @@ test_pyinstapaper
 Tests for `pyinstapaper` module.
 """
 
+import io
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import time
 import unittest
 
 from mock import patch
 
-from pyinstapaper.instapaper import Instapaper, Bookmark
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from pyinstapaper import profiling, serialization, watch
+from pyinstapaper.idset import IDSet
+from pyinstapaper.instapaper import Instapaper, Bookmark, Highlight
+from pyinstapaper.sync import HighlightStore, HighlightSync
 
 
 LOGIN_RESPONSE = (
@@ -115,6 +131,106 @@ HIGHLIGHTS_RESPONSE = (
 ]
     ''')
 
+BOOKMARKS_CHANGED_RESPONSE = (
+    {'status': '200'},
+    '''
+[
+    {
+        "type":"meta",
+        "delete_ids":"124"
+    },
+    {
+        "hash":"Hq7dNb1x",
+        "description":"",
+        "bookmark_id": 123,
+        "private_source":"",
+        "title":"Hello World",
+        "url":"http://helloworld.com/2015/4/hello",
+        "progress_timestamp":1444300000,
+        "time":1444260591,
+        "progress":0.5,
+        "starred":"0",
+        "type":"bookmark"
+    },
+    {
+        "hash":"Zx9aLq2w",
+        "description":"",
+        "bookmark_id":125,
+        "private_source":"",
+        "title":"Foo Bar",
+        "url":"http://www.example.com/foo/bar/",
+        "progress_timestamp":0,
+        "time":1444245139,
+        "progress":0.0,
+        "starred":"1",
+        "type":"bookmark"
+    },
+    {
+        "hash":"p0TqWm3e",
+        "description":"",
+        "bookmark_id":126,
+        "private_source":"",
+        "title":"Brand New",
+        "url":"http://www.example.com/new/",
+        "progress_timestamp":0,
+        "time":1444270000,
+        "progress":0.0,
+        "starred":"0",
+        "type":"bookmark"
+    }
+]
+    '''
+)
+
+BOOKMARK_UNSTARRED_RESPONSE = (
+    {'status': '200'},
+    '''
+[
+    {
+        "hash":"Vb2kYc8r",
+        "description":"",
+        "bookmark_id":125,
+        "private_source":"",
+        "title":"Foo Bar",
+        "url":"http://www.example.com/foo/bar/",
+        "progress_timestamp":0,
+        "time":1444245139,
+        "progress":0.0,
+        "starred":"0",
+        "type":"bookmark"
+    }
+]
+    '''
+)
+
+NO_CHANGES_RESPONSE = (
+    {'status': '200'},
+    '[{"type":"meta"}]'
+)
+
+HIGHLIGHT_CREATED_RESPONSE = (
+    {'status': '200'},
+    '''
+[
+    {
+        "highlight_id": 789,
+        "text": "a new quote",
+        "bookmark_id": 123,
+        "time": 1443559300,
+        "position": 0,
+        "type": "highlight"
+    }
+]
+    '''
+)
+
+DUPLICATE_HIGHLIGHT_RESPONSE = (
+    {'status': '200'},
+    '[{"type":"error","error_code":1601,"message":"Duplicate highlight"}]'
+)
+
+EMPTY_RESPONSE = ({'status': '200'}, '[]')
+
 
 def request_side_effect(*args, **kwargs):
     path = args[0]
@@ -161,5 +277,285 @@ class TestPyInstapaper(unittest.TestCase):
         highlight = highlights[0]
         self.assertEqual(highlight.text, 'Here is the highlighted text')
 
+    def test_profile(self):
+        client = self._get_pacthed_client()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            stats_file = os.path.join(tmpdir, 'run.pstats')
+            collapsed_file = os.path.join(tmpdir, 'run.folded')
+            stream = StringIO()
+            with profiling.profile(stats_file, collapsed_file,
+                                   stream=stream) as profiler:
+                client.get_bookmarks()
+            request = ('get_bookmarks', 'request')
+            self.assertEqual(profiler.calls[request], 1)
+            self.assertEqual(profiler.calls[request + ('json',)], 1)
+            self.assertEqual(
+                profiler.calls[('get_bookmarks', 'model_init')], 3)
+            self.assertGreaterEqual(
+                profiler.seconds[request + ('sleep',)], 0.4)
+            self.assertIn('fromtimestamp', stream.getvalue())
+            pstats.Stats(stats_file)
+            with open(collapsed_file) as folded:
+                stacks = [line.split()[0] for line in folded]
+            self.assertIn('get_bookmarks;request;sleep', stacks)
+        finally:
+            shutil.rmtree(tmpdir)
+        # inactive again once the block exits
+        self.assertIs(profiling.stage('json'), profiling._NULL_STAGE)
+
+    def test_profile_overlapping_threads(self):
+        original = profiling.httplib2.Http.__dict__['request']
+        outer_entered = threading.Event()
+        inner_exited = threading.Event()
+        profilers = []
+
+        def outer():
+            with profiling.profile(report=False) as profiler:
+                profilers.append(profiler)
+                outer_entered.set()
+                inner_exited.wait(5)
+                with profiling.stage('outer'):
+                    pass
+
+        thread = threading.Thread(target=outer)
+        thread.start()
+        outer_entered.wait(5)
+        with profiling.profile(report=False) as inner:
+            with profiling.stage('inner'):
+                pass
+        inner_exited.set()
+        thread.join()
+        self.assertEqual(inner.calls[('inner',)], 1)
+        self.assertEqual(profilers[0].calls[('outer',)], 1)
+        # instrumentation stays until the last block exits
+        self.assertIs(profiling.httplib2.Http.__dict__['request'], original)
+        self.assertIs(profiling.stage('json'), profiling._NULL_STAGE)
+
+    def test_serialization(self):
+        client = self._get_pacthed_client()
+        bookmarks = client.get_bookmarks()
+        data = bookmarks[0].to_dict()
+        self.assertEqual(data['time'], 1444260591)
+        self.assertEqual(data['progress_timestamp'], 0)
+        codecs = ['jsonl', 'columnar']
+        if serialization.msgpack is not None:
+            codecs.append('msgpack')
+        if serialization.pyarrow is not None:
+            codecs.append('arrow')
+        for codec in codecs:
+            fp = io.BytesIO()
+            Bookmark.dump(bookmarks, fp, codec=codec)
+            fp.seek(0)
+            loaded = Bookmark.load(fp, client, codec=codec)
+            self.assertEqual(
+                [b.to_dict() for b in loaded],
+                [b.to_dict() for b in bookmarks])
+            self.assertEqual(loaded[1].time, bookmarks[1].time)
+            fp.seek(0)
+            columns = Bookmark.load_columns(fp, codec=codec)
+            self.assertEqual(columns['bookmark_id'], [123, 124, 125])
+            self.assertEqual(columns['time'][0], 1444260591)
+        with self.assertRaises(ValueError):
+            Bookmark.dump(bookmarks, io.BytesIO(), codec='xml')
+
+    @patch('pyinstapaper.instapaper.REQUEST_DELAY_SECS', 0)
+    def _get_watch_client(self, *list_responses):
+        client = self._get_pacthed_client()
+        responses = list(list_responses)
+
+        def side_effect(*args, **kwargs):
+            if args[0].endswith('bookmarks/list'):
+                return responses.pop(0)
+            return request_side_effect(*args, **kwargs)
+        client.oauth_client.request.side_effect = side_effect
+        return client
+
+    def _watch_requests(self, client, suffix):
+        return [call for call in client.oauth_client.request.call_args_list
+                if call[0][0].endswith(suffix)]
+
+    @patch('pyinstapaper.instapaper.REQUEST_DELAY_SECS', 0)
+    def test_idset(self):
+        ids = IDSet(['5', 3, 1000000000000, 3, 200])
+        self.assertEqual(list(ids), [3, 5, 200, 1000000000000])
+        self.assertIn(200, ids)
+        self.assertNotIn(4, ids)
+        joined = ids.joined()
+        self.assertEqual(joined, '3,5,200,1000000000000')
+        self.assertIs(ids.joined(), joined)
+        self.assertEqual(ids.joined(2), '200,1000000000000')
+        ids.update([4, 3])
+        ids.discard(5)
+        self.assertEqual(ids.joined(), '3,4,200,1000000000000')
+        ids.update(range(1000, 1100))
+        self.assertEqual(len(ids), 104)
+        self.assertEqual(IDSet.from_bytes(ids.to_bytes()), ids)
+
+    def test_bookmarks_have_window(self):
+        client = self._get_pacthed_client()
+        have = IDSet([1, 2, 124, 500])
+        bookmarks = client.get_bookmarks(have=have, have_window=1)
+        body = client.oauth_client.request.call_args[1]['body']
+        self.assertIn('have=500&', body + '&')
+        # 124 is known but outside the window, so it is filtered locally
+        self.assertEqual([b.object_id for b in bookmarks], [123, 125])
+
+    @unittest.skipUnless(hasattr(time, 'tzset'), 'needs time.tzset')
+    def test_to_dict_dst_round_trip(self):
+        tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'America/New_York'
+        time.tzset()
+        try:
+            # 01:30 local time occurs twice on this date
+            for ts in (1446355800, 1446359400):
+                bookmark = Bookmark(None, bookmark_id=1, time=ts)
+                self.assertEqual(bookmark.to_dict()['time'], ts)
+        finally:
+            if tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = tz
+            time.tzset()
+
+    def test_watch(self):
+        client = self._get_watch_client(
+            BOOKMARKS_RESPONSE, BOOKMARKS_CHANGED_RESPONSE,
+            BOOKMARK_UNSTARRED_RESPONSE, NO_CHANGES_RESPONSE,
+            NO_CHANGES_RESPONSE, NO_CHANGES_RESPONSE)
+        watcher = client.watch(
+            ['unread'], interval=10, max_interval=30, highlights=True)
+        starred = []
+        watcher.subscribe(starred.append, types=[watch.STARRED])
+        events = watcher.events()
+
+        # priming is silent, skips highlights and does not back off
+        self.assertEqual(watcher.poll(), [])
+        self.assertEqual(self._watch_requests(client, '/highlights'), [])
+        self.assertEqual(watcher.current_interval, 10)
+
+        changes = watcher.poll()
+        body = self._watch_requests(client, 'bookmarks/list')[-1][1]['body']
+        self.assertIn('123%3AD2nAUhDQ', body)
+        self.assertEqual(
+            sorted((e.type, (e.bookmark or e.previous).object_id)
+                   for e in changes if e.type != watch.HIGHLIGHT_ADDED),
+            [(watch.ADDED, 126), (watch.PROGRESS_CHANGED, 123),
+             (watch.REMOVED, 124), (watch.STARRED, 125)])
+        self.assertEqual(
+            sorted(e.highlight.object_id for e in changes
+                   if e.type == watch.HIGHLIGHT_ADDED),
+            [123, 456])
+        self.assertEqual([e.bookmark.object_id for e in starred], [125])
+
+        changes = watcher.poll()
+        self.assertEqual([e.type for e in changes], [watch.UNSTARRED])
+        self.assertEqual(len(starred), 1)
+
+        intervals = []
+        for _ in range(3):
+            self.assertEqual(watcher.poll(), [])
+            intervals.append(watcher.current_interval)
+        self.assertEqual(intervals, [20, 30, 30])
+        watcher.stop()
+        self.assertEqual(len(list(events)), 7)
+
+    @patch('pyinstapaper.instapaper.REQUEST_DELAY_SECS', 0)
+    def test_watch_emit_initial(self):
+        client = self._get_watch_client(BOOKMARKS_RESPONSE)
+        watcher = client.watch(['unread'], emit_initial=True)
+        changes = watcher.poll()
+        self.assertEqual([e.type for e in changes], [watch.ADDED] * 3)
+
+    @patch('pyinstapaper.instapaper.REQUEST_DELAY_SECS', 0)
+    def test_watch_consumers_unsubscribe(self):
+        client = self._get_watch_client(BOOKMARKS_RESPONSE)
+        watcher = client.watch(['unread'], emit_initial=True)
+        events = watcher.events()
+        self.assertEqual(len(watcher._queues), 1)
+        del events
+        self.assertEqual(watcher._queues, [])
+
+    @unittest.skipIf(sys.version_info < (3, 6), 'asyncio iteration')
+    @patch('pyinstapaper.instapaper.REQUEST_DELAY_SECS', 0)
+    def test_watch_async(self):
+        import asyncio
+        client = self._get_watch_client(BOOKMARKS_RESPONSE)
+        watcher = client.watch(['unread'], emit_initial=True)
+        loop = asyncio.new_event_loop()
+        try:
+            consumer = watcher.aevents()
+            first = asyncio.ensure_future(consumer.__anext__(), loop=loop)
+            loop.call_later(0.05, threading.Thread(target=watcher.poll).start)
+            event = loop.run_until_complete(first)
+            self.assertEqual(event.type, watch.ADDED)
+            self.assertEqual(len(watcher._queues), 1)
+            # leaving the loop early unsubscribes
+            loop.run_until_complete(consumer.aclose())
+            self.assertEqual(watcher._queues, [])
+        finally:
+            loop.close()
+
+    @patch('pyinstapaper.instapaper.REQUEST_DELAY_SECS', 0)
+    def test_highlight_sync(self):
+        client = self._get_pacthed_client()
+        lists = [BOOKMARKS_RESPONSE, NO_CHANGES_RESPONSE]
+        deleted = []
+
+        def side_effect(path, **kwargs):
+            if path.endswith('bookmarks/list'):
+                return lists.pop(0)
+            elif path.endswith('bookmarks/123/highlights'):
+                return HIGHLIGHTS_RESPONSE
+            elif path.endswith('/highlights'):
+                return EMPTY_RESPONSE
+            elif path.endswith('bookmarks/123/highlight'):
+                if 'duplicate' in kwargs['body']:
+                    return DUPLICATE_HIGHLIGHT_RESPONSE
+                return HIGHLIGHT_CREATED_RESPONSE
+            elif path.endswith('/delete'):
+                deleted.append(path)
+                if not path.endswith('highlights/789/delete'):
+                    return DUPLICATE_HIGHLIGHT_RESPONSE
+                return EMPTY_RESPONSE
+        request = client.oauth_client.request
+        request.side_effect = side_effect
+        sync = HighlightSync(client, folders=['unread'])
+
+        stats = sync.pull()
+        self.assertEqual(sorted(sync.store.highlights), [123, 456])
+        self.assertEqual((stats.api_calls, stats.api_calls_saved), (4, 0))
+        self.assertEqual(stats.highlights, 2)
+
+        stats = sync.pull()
+        self.assertEqual((stats.api_calls, stats.api_calls_saved), (1, 3))
+        self.assertIn('123%3AD2nAUhDQ', request.call_args[1]['body'])
+
+        stats = sync.push([
+            Highlight(None, bookmark_id=123, text='a new quote'),
+            Highlight(None, bookmark_id=123, text='an important phrase'),
+            Highlight(None, bookmark_id=123, text='duplicate'),
+        ])
+        self.assertEqual(stats.highlights, 1)
+        self.assertEqual(len(stats.conflicts), 2)
+        self.assertEqual(sync.store.highlights[789].text, 'a new quote')
+
+        # refused deletes: 999 is already gone remotely, 456 is not
+        sync.store.add(Highlight(client, highlight_id=999, bookmark_id=123))
+        stats = sync.delete([789, 999, 456, 4040])
+        self.assertEqual(stats.highlights, 2)
+        self.assertEqual([f[0] for f in stats.failures], [456])
+        self.assertEqual(
+            [c[1] for c in stats.conflicts], ['already deleted', 'unknown'])
+        self.assertEqual(sorted(sync.store.highlights), [123, 456])
+        self.assertEqual(len(sync.runs), 4)
+
+        fp = StringIO()
+        sync.store.dump(fp)
+        fp.seek(0)
+        store = HighlightStore.load(fp, client)
+        self.assertEqual(sorted(store.highlights), [123, 456])
+        self.assertEqual(store.bookmarks, sync.store.bookmarks)
+
     def tearDown(self):  # noqa
         pass